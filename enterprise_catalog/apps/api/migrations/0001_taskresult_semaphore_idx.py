@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+# `unready_tasks` looks up celery TaskResults by task name, status, and creation date.
+# The TaskResult model belongs to django-celery-results, so the composite index is
+# added through the schema editor rather than declared on the model.
+TASK_RESULT_SEMAPHORE_INDEX = models.Index(
+    fields=['task_name', 'status', '-date_created'],
+    name='tr_name_status_date_idx',
+)
+
+
+def add_task_result_semaphore_index(apps, schema_editor):
+    TaskResult = apps.get_model('django_celery_results', 'TaskResult')
+    schema_editor.add_index(TaskResult, TASK_RESULT_SEMAPHORE_INDEX)
+
+
+def remove_task_result_semaphore_index(apps, schema_editor):
+    TaskResult = apps.get_model('django_celery_results', 'TaskResult')
+    schema_editor.remove_index(TaskResult, TASK_RESULT_SEMAPHORE_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_results', '0008_chordcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_task_result_semaphore_index, reverse_code=remove_task_result_semaphore_index),
+    ]
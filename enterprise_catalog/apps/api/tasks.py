@@ -1,12 +1,13 @@
-import copy
 import functools
+import hashlib
 import json
 import logging
 from collections import defaultdict
 from datetime import timedelta
 
 from celery import shared_task, states
-from celery.exceptions import Ignore
+from celery.exceptions import Ignore, Retry
+from celery.signals import task_failure, task_revoked
 from celery_utils.logged_task import LoggedTask
 from django.core.cache import cache
 from django.db import IntegrityError
@@ -20,10 +21,11 @@ from enterprise_catalog.apps.catalog.algolia_utils import (
     ALGOLIA_FIELDS,
     ALGOLIA_UUID_BATCH_SIZE,
     configure_algolia_index,
-    create_algolia_objects_from_courses,
     get_algolia_object_id,
     get_initialized_algolia_client,
+    iter_algolia_objects_from_courses,
     partition_course_keys_for_indexing,
+    partition_course_keys_for_indexing_values,
 )
 from enterprise_catalog.apps.catalog.constants import (
     COURSE,
@@ -33,6 +35,7 @@ from enterprise_catalog.apps.catalog.constants import (
 from enterprise_catalog.apps.catalog.models import (
     CatalogQuery,
     ContentMetadata,
+    EnterpriseCatalog,
     update_contentmetadata_from_discovery,
 )
 from enterprise_catalog.apps.catalog.utils import batch, localized_utcnow
@@ -41,9 +44,12 @@ from enterprise_catalog.apps.catalog.utils import batch, localized_utcnow
 logger = logging.getLogger(__name__)
 
 ONE_HOUR = timedelta(hours=1)
+ONE_DAY = timedelta(days=1)
 
 UNREADY_TASK_RETRY_COUNTDOWN_SECONDS = 60 * 5
 
+TASK_RESULT_PURGE_BATCH_SIZE = 10000
+
 
 def _fetch_courses_by_keys(course_keys):
     """
@@ -75,6 +81,9 @@ def unready_tasks(celery_task, time_delta):
     {'RECEIVED', 'REJECTED', 'STARTED', 'PENDING', 'RETRY'}.
     https://docs.celeryproject.org/en/v5.0.5/reference/celery.states.html#unready-states
 
+    Only the identifying columns of each task are selected, leaving out the potentially large
+    ``result``, ``traceback``, and ``meta`` columns.
+
     Args:
       celery_task: A celery task definition or "type" (not an applied task "instance"),
         for example, ``update_catalog_metadata_task``.
@@ -84,32 +93,100 @@ def unready_tasks(celery_task, time_delta):
         task_name=celery_task.name,
         date_created__gte=localized_utcnow() - time_delta,
         status__in=states.UNREADY_STATES,
+    ).only('task_id', 'task_name', 'task_args', 'task_kwargs', 'status', 'date_created')
+
+
+class OnceLockBackend:
+    """
+    Expiring lock, keyed on a task's (name, args, kwargs), that prevents equivalent tasks
+    from being run more than once within a given window (similar to celery-once/celery-singleton).
+
+    The lock lives in the Django cache; ``cache.add`` only sets a key that does not already
+    exist (``SET NX EX`` on Redis, ``add`` on Memcached), so acquiring the lock is a single
+    atomic operation with a native TTL.
+    """
+    KEY_PREFIX = 'ecat:once:'
+
+    def get_key(self, task_name, args, kwargs):
+        """
+        Returns the lock key for a task with the given name, args, and kwargs.
+        """
+        canonical_args = json.dumps([list(args or ()), kwargs or {}], sort_keys=True, default=str)
+        digest = hashlib.sha256('{}|{}'.format(task_name, canonical_args).encode()).hexdigest()
+        return self.KEY_PREFIX + digest
+
+    def acquire(self, key, task_id, timeout):
+        """
+        Attempts to acquire the lock for ``key`` on behalf of ``task_id``, expiring after
+        ``timeout`` seconds. Returns whether the lock was acquired.
+        """
+        return cache.add(key, task_id, timeout)
+
+    def get(self, key):
+        """
+        Returns the id of the task currently holding the lock for ``key``, if any.
+        """
+        return cache.get(key)
+
+    def release(self, key):
+        """
+        Releases the lock for ``key``.
+        """
+        cache.delete(key)
+
+    def release_if_held_by(self, key, task_id):
+        """
+        Releases the lock for ``key`` only if it is held by ``task_id``.
+        """
+        if self.get(key) == str(task_id):
+            self.release(key)
+
+
+once_lock_backend = OnceLockBackend()
+
+
+def _task_lock_key(task_object):
+    return once_lock_backend.get_key(task_object.name, task_object.request.args, task_object.request.kwargs)
+
+
+@task_failure.connect
+def release_failed_task_lock(sender=None, task_id=None, args=None, kwargs=None, **_):
+    """
+    Releases the semaphore lock held by a task that failed, so that an equivalent task may run again right away.
+    """
+    once_lock_backend.release_if_held_by(once_lock_backend.get_key(sender.name, args, kwargs), task_id)
+
+
+@task_revoked.connect
+def release_revoked_task_lock(sender=None, request=None, **_):
+    """
+    Releases the semaphore lock held by a task that was revoked, e.g. terminated with ``revoke(terminate=True)``
+    while running. The worker's parent process reports this, so the task body never sees an exception.
+    """
+    once_lock_backend.release_if_held_by(
+        once_lock_backend.get_key(sender.name, request.args, request.kwargs),
+        request.id,
     )
 
 
 def task_recently_run(task_object, time_delta):
     """
-    Given a celery Task, queries the `TaskResult` model to determine
-    if a task with the same (name, args, kwargs) was created
-    within the given (now - time_delta, now) range.
+    Given a celery Task, attempts to acquire the lock for the task's (name, args, kwargs)
+    to determine if an equivalent task was started within the given (now - time_delta, now) range.
 
     Args:
       task_object (Task): A celery task object.
       time_delta (timedelta): A timedelta.
     Returns:
-      Boolean: Whether an equivalent task with the same (name, args, kwargs) recently existed
-      in a non-failure or non-revoked state.
+      Boolean: Whether an equivalent task with the same (name, args, kwargs) but a different
+      task id recently ran without failing.
     """
-    return TaskResult.objects.filter(
-        task_name=task_object.name,
-        task_args=json.dumps(task_object.request.args),
-        task_kwargs=json.dumps(task_object.request.kwargs),
-        date_created__gte=localized_utcnow() - time_delta,
-    ).exclude(
-        status__in=(states.FAILURE, states.REVOKED),
-    ).exclude(
-        task_id=str(task_object.request.id),
-    ).exists()
+    lock_key = _task_lock_key(task_object)
+    task_id = str(task_object.request.id)
+    if once_lock_backend.acquire(lock_key, task_id, int(time_delta.total_seconds())):
+        return False
+    # The lock may already be held by this very task, e.g. when it is being retried.
+    return once_lock_backend.get(lock_key) != task_id
 
 
 class TaskRecentlyRunError(Ignore):
@@ -131,7 +208,13 @@ def expiring_task_semaphore(time_delta=None):
     Celery Task decorator that wraps a bound (bind=True) task.
     If another task with the same (name, args, kwargs) as the given task
     was executed in the time between `time_delta` and now, the task moves to a REVOKED
-    state and raises a `TaskRecentlyRunError`.
+    state and raises a `TaskRecentlyRunError`. If the task fails or is revoked, its lock is
+    released so that an equivalent task may be run again right away.
+
+    Celery 4 records a task that hits its hard time limit, or whose worker process is lost,
+    from the worker's parent process without raising in the task or sending any signal, so the
+    lock of such a task is not released: equivalent tasks are refused until the lock expires
+    after `time_delta` (up to an hour by default), unless they are invoked with `force`.
 
     If task is invoked with `force` kwarg, time since last run will be ignored.
 
@@ -167,7 +250,14 @@ def expiring_task_semaphore(time_delta=None):
                     },
                 )
                 raise TaskRecentlyRunError(message)
-            return task(self, *args, *kwargs)
+            try:
+                return task(self, *args, *kwargs)
+            except Retry:
+                # the retried task keeps its id, and so may re-enter its own lock
+                raise
+            except Exception:
+                once_lock_backend.release(_task_lock_key(self))
+                raise
         return wrapped_task
     return decorator
 
@@ -191,6 +281,25 @@ class LoggedTaskWithRetry(LoggedTask):  # pylint: disable=abstract-method
     retry_jitter = True
 
 
+@shared_task(base=LoggedTaskWithRetry)
+def purge_expired_task_results():
+    """
+    Deletes the `TaskResult` records that were created more than a day ago. Records are deleted
+    in batches of ``TASK_RESULT_PURGE_BATCH_SIZE`` to avoid holding long-running transactions.
+    """
+    cutoff = localized_utcnow() - ONE_DAY
+    expired_task_results = TaskResult.objects.filter(date_created__lt=cutoff)
+    total_deleted = 0
+    while True:
+        expired_ids = list(expired_task_results.values_list('id', flat=True)[:TASK_RESULT_PURGE_BATCH_SIZE])
+        if not expired_ids:
+            break
+        deleted, __ = TaskResult.objects.filter(id__in=expired_ids).delete()
+        total_deleted += deleted
+
+    logger.info('Purged %d TaskResult records created before %s.', total_deleted, cutoff)
+
+
 @shared_task(base=LoggedTaskWithRetry, bind=True, default_retry_delay=UNREADY_TASK_RETRY_COUNTDOWN_SECONDS)
 @expiring_task_semaphore()
 def update_full_content_metadata_task(self, force=False):  # pylint: disable=unused-argument
@@ -207,7 +316,7 @@ def update_full_content_metadata_task(self, force=False):  # pylint: disable=unu
             exc=RequiredTaskUnreadyError(),
         )
 
-    content_keys = [metadata.content_key for metadata in ContentMetadata.objects.filter(content_type=COURSE)]
+    content_keys = list(ContentMetadata.objects.filter(content_type=COURSE).values_list('content_key', flat=True))
     _update_full_content_metadata(content_keys)
 
 
@@ -236,13 +345,7 @@ def _update_full_content_metadata(content_keys):
 
         # Build a dictionary of the metadata that corresponds to the fetched keys to avoid a query for every course
         fetched_course_keys = [course['key'] for course in full_course_dicts]
-        metadata_records_for_fetched_keys = ContentMetadata.objects.filter(
-            content_key__in=fetched_course_keys,
-        )
-        metadata_by_key = {
-            metadata.content_key: metadata
-            for metadata in metadata_records_for_fetched_keys
-        }
+        metadata_by_key = ContentMetadata.objects.in_bulk(fetched_course_keys, field_name='content_key')
 
         # Iterate through the courses to update the json_metadata field,
         # merging the minimal json_metadata retrieved by
@@ -282,7 +385,8 @@ def _update_full_content_metadata(content_keys):
 def _batched_metadata(json_metadata, sorted_uuids, uuid_key_name, obj_id_fmt):
     batched_metadata = []
     for batch_index, uuid_batch in enumerate(batch(sorted_uuids, batch_size=ALGOLIA_UUID_BATCH_SIZE)):
-        json_metadata_with_uuids = copy.deepcopy(json_metadata)
+        # only top-level keys are set on the copy, so the nested metadata can be shared between the batches
+        json_metadata_with_uuids = dict(json_metadata)
         json_metadata_with_uuids.update({
             'objectID': obj_id_fmt.format(json_metadata['objectID'], batch_index),
             uuid_key_name: uuid_batch,
@@ -310,8 +414,13 @@ def index_enterprise_catalog_courses_in_algolia_task(self, force=False):  # pyli
             exc=RequiredTaskUnreadyError(),
         )
 
-    courses_content_metadata = ContentMetadata.objects.filter(content_type=COURSE)
-    indexable_content_keys, nonindexable_content_keys = partition_course_keys_for_indexing(courses_content_metadata)
+    # only the content key and json_metadata are needed to partition the courses, so skip building model instances
+    courses_content_metadata_values = ContentMetadata.objects.filter(
+        content_type=COURSE,
+    ).values('content_key', 'json_metadata').iterator(chunk_size=2000)
+    indexable_content_keys, nonindexable_content_keys = partition_course_keys_for_indexing_values(
+        courses_content_metadata_values,
+    )
     _reindex_algolia(
         indexable_content_keys=indexable_content_keys,
         nonindexable_content_keys=nonindexable_content_keys,
@@ -330,8 +439,23 @@ def index_content_keys_in_algolia(content_keys, algolia_client):
     logger.info(
         'There are {} total content keys to include in the Algolia index.'.format(len(content_keys))
     )
-    courses = []
+    # The Algolia objects are generated lazily as the client sends them to Algolia in chunks,
+    # so only a single batch of content keys worth of objects is held in memory at a time.
+    algolia_objects = _get_algolia_objects_from_content_keys(content_keys)
+    algolia_client.replace_all_objects(algolia_objects)
+
+
+def _get_algolia_objects_from_content_keys(content_keys):
+    """
+    Generates the Algolia objects for the specified content keys, one batch of content keys at a time.
+
+    Arguments:
+        content_keys (list): List of indexable content_key strings.
+    Yields:
+        dict: An Algolia object containing only the fields noted in ALGOLIA_FIELDS.
+    """
     for content_keys_batch in batch(content_keys, batch_size=TASK_BATCH_SIZE):
+        courses = []
         catalog_uuids_by_course_key = defaultdict(set)
         catalog_query_uuids_by_course_key = defaultdict(set)
         customer_uuids_by_course_key = defaultdict(set)
@@ -340,8 +464,10 @@ def index_content_keys_in_algolia(content_keys, algolia_client):
         # content_key or parent_content_key. returns both courses and course runs.
         query = Q(content_key__in=content_keys_batch) | Q(parent_content_key__in=content_keys_batch)
 
-        catalog_queries = CatalogQuery.objects.prefetch_related(
-            'enterprise_catalogs',
+        # only the uuids of the associated catalog queries and catalogs are needed
+        enterprise_catalogs = EnterpriseCatalog.objects.only('uuid', 'enterprise_uuid', 'catalog_query')
+        catalog_queries = CatalogQuery.objects.only('uuid').prefetch_related(
+            Prefetch('enterprise_catalogs', queryset=enterprise_catalogs),
         )
         content_metadata = ContentMetadata.objects.filter(query).prefetch_related(
             Prefetch('catalog_queries', queryset=catalog_queries),
@@ -379,20 +505,23 @@ def index_content_keys_in_algolia(content_keys, algolia_client):
         # if the number of uuids for both catalogs/customers exceeds ALGOLIA_UUID_BATCH_SIZE, then
         # create duplicate course records, batching the uuids (flattened records) to reduce
         # the payload size of the Algolia objects.
-        course_content_metadata = content_metadata.filter(content_type=COURSE)
+        #
+        # the courses are picked out of the records already fetched above, rather than querying for
+        # them (and their prefetched catalog queries and catalogs) a second time.
+        course_content_metadata = [metadata for metadata in content_metadata if metadata.content_type == COURSE]
         for metadata in course_content_metadata:
             content_key = metadata.content_key
             if _was_recently_indexed(content_key):
                 continue
 
             # add enterprise-related uuids to json_metadata
-            json_metadata = copy.deepcopy(metadata.json_metadata)
+            json_metadata = dict(metadata.json_metadata)
             json_metadata.update({
                 'objectID': get_algolia_object_id(json_metadata.get('uuid')),
             })
 
             # enterprise catalog uuids
-            catalog_uuids = sorted(list(catalog_uuids_by_course_key[content_key]))
+            catalog_uuids = sorted(catalog_uuids_by_course_key[content_key])
             batched_metadata = _batched_metadata(
                 json_metadata,
                 catalog_uuids,
@@ -402,7 +531,7 @@ def index_content_keys_in_algolia(content_keys, algolia_client):
             courses.extend(batched_metadata)
 
             # enterprise customer uuids
-            customer_uuids = sorted(list(customer_uuids_by_course_key[content_key]))
+            customer_uuids = sorted(customer_uuids_by_course_key[content_key])
             batched_metadata = _batched_metadata(
                 json_metadata,
                 customer_uuids,
@@ -413,7 +542,7 @@ def index_content_keys_in_algolia(content_keys, algolia_client):
             _mark_recently_indexed(content_key)
 
             # enterprise catalog query uuids
-            query_uuids = sorted(list(catalog_query_uuids_by_course_key[content_key]))
+            query_uuids = sorted(catalog_query_uuids_by_course_key[content_key])
             batched_metadata = _batched_metadata(
                 json_metadata,
                 query_uuids,
@@ -422,9 +551,8 @@ def index_content_keys_in_algolia(content_keys, algolia_client):
             )
             courses.extend(batched_metadata)
 
-    # extract out only the fields we care about and send to Algolia index
-    algolia_objects = create_algolia_objects_from_courses(courses, ALGOLIA_FIELDS)
-    algolia_client.replace_all_objects(algolia_objects)
+        # extract out only the fields we care about to send to the Algolia index
+        yield from iter_algolia_objects_from_courses(courses, ALGOLIA_FIELDS)
 
 
 def _reindex_algolia(indexable_content_keys, nonindexable_content_keys):
@@ -6,9 +6,12 @@ import uuid
 from datetime import timedelta
 from unittest import mock
 
-import ddt
 from celery import states
-from django.test import TestCase
+from celery.app.task import Context
+from celery.exceptions import Retry
+from celery.signals import task_failure, task_revoked
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
 from django_celery_results.models import TaskResult
 
 from enterprise_catalog.apps.api import tasks
@@ -34,22 +37,46 @@ def mock_task(self, *args, **kwargs):  # pylint: disable=unused-argument
     return COMPUTED_PRECIOUS_OBJECT
 
 
+@tasks.expiring_task_semaphore()
+def mock_failing_task(self, *args, **kwargs):
+    """
+    A mock task that fails, and shares a name with our `mock_task`.
+    """
+    raise Exception('Task failed')
+
+
+@tasks.expiring_task_semaphore()
+def mock_retrying_task(self, *args, **kwargs):
+    """
+    A mock task that asks to be retried, and shares a name with our `mock_task`.
+    """
+    raise Retry()
+
+
 # An actual celery task would have a name attribute, and we use
 # it in a few places, so we patch it in here.
 mock_task.name = 'mock_task'
+mock_failing_task.name = mock_task.name
+mock_retrying_task.name = mock_task.name
 
 
-@ddt.ddt
-class TestTaskResultFunctions(TestCase):
+class ClearTaskCachesMixin:
     """
-    Tests for functions in tasks.py that rely upon `django-celery_results.models.TaskResult`.
+    Clears the cache the tasks keep state in between runs, i.e. the semaphore locks and the record of
+    recently indexed content keys, so that it does not leak from one test into another.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+class TestExpiringTaskSemaphore(ClearTaskCachesMixin, SimpleTestCase):
+    """
+    Tests for the `expiring_task_semaphore` decorator, which keeps its locks in the cache rather than the database.
     """
     def setUp(self):
-        """
-        Delete all TaskResult objects, make a new single result object.
-        """
         super().setUp()
-        TaskResult.objects.all().delete()
 
         self.test_args = (123, 77)
         self.test_kwargs = {'foo': 'bar'}
@@ -57,97 +84,190 @@ class TestTaskResultFunctions(TestCase):
         self.mock_task_id = uuid.uuid4()
         self.other_task_id = uuid.uuid4()
 
-        self.mock_task_result = TaskResult.objects.create(
-            task_name=mock_task.name,
-            task_args=json.dumps(self.test_args),
-            task_kwargs=json.dumps(self.test_kwargs),
-            status=states.SUCCESS,
-            # Default to a state where the only recorded task result is for some "other" task
-            task_id=self.other_task_id,
-        )
-
-    def mock_task_instance(self, *args, **kwargs):
+    def mock_task_instance(self, *args, task=mock_task, **kwargs):
         """
         Helper method that creates a "bound task object", which is a stand-in
         for what `self` would be in the body of a celery task that has `bind=True` specified.
-        Invokes our `mock_task` with that bound object and the given args and kwargs.
+        Invokes our `mock_task` (or the given `task`) with that bound object and the given args and kwargs.
         """
         bound_task_object = mock.MagicMock()
         bound_task_object.name = mock_task.name
         bound_task_object.request.id = self.mock_task_id
         bound_task_object.request.args = args
         bound_task_object.request.kwargs = kwargs
-        return mock_task(bound_task_object, *args, **kwargs)
+        return task(bound_task_object, *args, **kwargs)
+
+    def mock_task_sender(self):
+        """
+        Helper that returns a stand-in for the celery task that sends task signals about our `mock_task`.
+        """
+        task_sender = mock.MagicMock()
+        task_sender.name = mock_task.name
+        return task_sender
+
+    def lock_key(self, *args, **kwargs):
+        """
+        Helper that returns the semaphore lock key for our `mock_task` with the given args and kwargs.
+        """
+        return tasks.once_lock_backend.get_key(mock_task.name, args, kwargs)
 
     def test_semaphore_raises_recent_run_error_for_same_args(self):
-        self.mock_task_result.task_kwargs = '{}'
-        self.mock_task_result.save()
+        tasks.once_lock_backend.acquire(self.lock_key(*self.test_args), str(self.other_task_id), 60)
 
         with self.assertRaises(tasks.TaskRecentlyRunError):
             self.mock_task_instance(*self.test_args)
 
     def test_semaphore_raises_recent_run_error_for_same_kwargs(self):
-        self.mock_task_result.task_args = '[]'
-        self.mock_task_result.save()
+        tasks.once_lock_backend.acquire(self.lock_key(**self.test_kwargs), str(self.other_task_id), 60)
 
         with self.assertRaises(tasks.TaskRecentlyRunError):
             self.mock_task_instance(**self.test_kwargs)
 
-    def test_task_with_result_older_than_an_hour_ignored_by_semaphore(self):
-        self.mock_task_result.date_created = localized_utcnow() - timedelta(hours=4)
-        self.mock_task_result.save()
+    def test_semaphore_ignores_different_args(self):
+        tasks.once_lock_backend.acquire(self.lock_key(*self.test_args), str(self.other_task_id), 60)
 
         result = self.mock_task_instance(*self.test_args, **self.test_kwargs)
         assert COMPUTED_PRECIOUS_OBJECT == result
 
-    @ddt.data(states.FAILURE, states.REVOKED)
-    def test_failed_or_revoked_tasks_are_ignored_by_semaphore(self, task_state):
-        self.mock_task_result.status = task_state
-        self.mock_task_result.date_created = localized_utcnow() - timedelta(minutes=1)
-        self.mock_task_result.save()
+    def test_semaphore_lock_timeout_is_one_hour(self):
+        with mock.patch('enterprise_catalog.apps.api.tasks.cache') as mock_cache:
+            mock_cache.add.return_value = True
+            result = self.mock_task_instance(*self.test_args, **self.test_kwargs)
+
+        assert COMPUTED_PRECIOUS_OBJECT == result
+        mock_cache.add.assert_called_once_with(
+            self.lock_key(*self.test_args, **self.test_kwargs),
+            str(self.mock_task_id),
+            60 * 60,
+        )
+
+    def test_failed_tasks_are_ignored_by_semaphore(self):
+        with self.assertRaises(Exception):
+            self.mock_task_instance(*self.test_args, task=mock_failing_task)
+
+        self.mock_task_id = uuid.uuid4()
+        result = self.mock_task_instance(*self.test_args)
+        assert result == COMPUTED_PRECIOUS_OBJECT
+
+    def test_retried_tasks_keep_their_semaphore_lock(self):
+        with self.assertRaises(Retry):
+            self.mock_task_instance(*self.test_args, task=mock_retrying_task)
 
+        # the lock is still held by the retried task, so an equivalent task with another id is refused...
+        lock_key = self.lock_key(*self.test_args)
+        assert tasks.once_lock_backend.get(lock_key) == str(self.mock_task_id)
+        self.mock_task_id, retried_task_id = self.other_task_id, self.mock_task_id
+        with self.assertRaises(tasks.TaskRecentlyRunError):
+            self.mock_task_instance(*self.test_args)
+
+        # ...while the retry itself, which keeps its task id, is let back in
+        self.mock_task_id = retried_task_id
         result = self.mock_task_instance(*self.test_args)
         assert result == COMPUTED_PRECIOUS_OBJECT
 
+    def test_revoked_tasks_release_their_semaphore_lock(self):
+        lock_key = self.lock_key(*self.test_args, **self.test_kwargs)
+        tasks.once_lock_backend.acquire(lock_key, str(self.mock_task_id), 60)
+
+        # e.g. revoke(terminate=True), which the worker's parent process reports
+        task_revoked.send(
+            sender=self.mock_task_sender(),
+            request=Context(id=str(self.mock_task_id), args=list(self.test_args), kwargs=self.test_kwargs),
+            terminated=True,
+            signum=15,
+            expired=False,
+        )
+
+        assert tasks.once_lock_backend.get(lock_key) is None
+
+    def test_failed_tasks_release_their_semaphore_lock(self):
+        lock_key = self.lock_key(*self.test_args)
+        tasks.once_lock_backend.acquire(lock_key, str(self.mock_task_id), 60)
+
+        task_failure.send(
+            sender=self.mock_task_sender(),
+            task_id=str(self.mock_task_id),
+            exception=Exception('Task failed'),
+            args=list(self.test_args),
+            kwargs={},
+        )
+
+        assert tasks.once_lock_backend.get(lock_key) is None
+
+    def test_failed_tasks_do_not_release_semaphore_lock_of_another_task(self):
+        lock_key = self.lock_key(*self.test_args)
+        tasks.once_lock_backend.acquire(lock_key, str(self.other_task_id), 60)
+
+        task_failure.send(
+            sender=self.mock_task_sender(),
+            task_id=str(self.mock_task_id),
+            exception=Exception('Task failed'),
+            args=list(self.test_args),
+            kwargs={},
+        )
+
+        assert tasks.once_lock_backend.get(lock_key) == str(self.other_task_id)
+
     def test_given_task_id_is_ignored_by_semaphore(self):
-        # Make our only TaskResult for a task with the same id
-        # as the mock task - set status and date such that the
-        # result would count as a recent equivalent task if it did _not_
-        # have the same task_id as the mock task that is "running".
-        self.mock_task_result.status = states.PENDING
-        self.mock_task_result.date_created = localized_utcnow() - timedelta(minutes=1)
-        self.mock_task_result.task_id = self.mock_task_id
-        self.mock_task_result.save()
+        # Make the lock for our args held by a task with the same id
+        # as the mock task - the lock would count as a recent equivalent
+        # task if it did _not_ belong to the mock task that is "running".
+        tasks.once_lock_backend.acquire(
+            self.lock_key(*self.test_args, **self.test_kwargs), str(self.mock_task_id), 60,
+        )
 
         result = self.mock_task_instance(*self.test_args, **self.test_kwargs)
         assert COMPUTED_PRECIOUS_OBJECT == result
 
-    @ddt.data(*states.UNREADY_STATES)
-    def test_unready_tasks_exist_for_unready_states(self, task_state):
-        self.mock_task_result.status = task_state
-        self.mock_task_result.save()
 
-        self.assertTrue(
-            tasks.unready_tasks(
-                mock_task, timedelta(hours=2)
-            ).exists()
+class TestTaskResultFunctions(TestCase):
+    """
+    Tests for functions in tasks.py that rely upon `django-celery_results.models.TaskResult`.
+    """
+    def setUp(self):
+        """
+        Delete all TaskResult objects, make a new single result object.
+        """
+        super().setUp()
+        TaskResult.objects.all().delete()
+
+        self.mock_task_result = TaskResult.objects.create(
+            task_name=mock_task.name,
+            task_args=json.dumps((123, 77)),
+            task_kwargs=json.dumps({'foo': 'bar'}),
+            status=states.SUCCESS,
+            task_id=uuid.uuid4(),
         )
 
-    @ddt.data(*states.READY_STATES)
-    def test_unready_tasks_dont_exist_for_ready_states(self, task_state):
-        self.mock_task_result.status = task_state
-        self.mock_task_result.save()
+    def _patch_row(self, **kwargs):
+        """
+        Helper that updates only the given fields of our TaskResult, both in the database and in memory.
+        """
+        TaskResult.objects.filter(pk=self.mock_task_result.pk).update(**kwargs)
+        self.mock_task_result.refresh_from_db(fields=list(kwargs))
 
-        self.assertFalse(
-            tasks.unready_tasks(
-                mock_task, timedelta(hours=2)
-            ).exists()
-        )
+    def test_unready_tasks_status_matrix(self):
+        # Loop over the states within a single test so that the fixture is only set up once
+        for task_state in states.UNREADY_STATES | states.READY_STATES:
+            with self.subTest(task_state=task_state):
+                self._patch_row(status=task_state)
+
+                self.assertEqual(
+                    tasks.unready_tasks(
+                        mock_task, timedelta(hours=2)
+                    ).exists(),
+                    task_state in states.UNREADY_STATES,
+                )
+
+    def test_unready_tasks_defer_large_columns(self):
+        self._patch_row(status=states.PENDING)
+
+        unready_task = tasks.unready_tasks(mock_task, timedelta(hours=2)).get()
+        assert unready_task.pk == self.mock_task_result.pk
+        assert {'result', 'traceback', 'meta'} <= unready_task.get_deferred_fields()
 
     def test_unready_tasks_dont_exist_for_more_recent_delta(self):
-        self.mock_task_result.status = states.PENDING
-        self.mock_task_result.date_created = localized_utcnow() - timedelta(hours=1)
-        self.mock_task_result.save()
+        self._patch_row(status=states.PENDING, date_created=localized_utcnow() - timedelta(hours=1))
 
         self.assertFalse(
             tasks.unready_tasks(
@@ -165,8 +285,23 @@ class TestTaskResultFunctions(TestCase):
             ).exists()
         )
 
+    @mock.patch('enterprise_catalog.apps.api.tasks.TASK_RESULT_PURGE_BATCH_SIZE', 1)
+    def test_purge_expired_task_results(self):
+        expired_task_result_ids = [
+            TaskResult.objects.create(task_name=mock_task.name, task_id=uuid.uuid4()).id
+            for __ in range(2)
+        ]
+        TaskResult.objects.filter(id__in=expired_task_result_ids).update(
+            date_created=localized_utcnow() - timedelta(days=2),
+        )
+
+        tasks.purge_expired_task_results()
+
+        self.assertFalse(TaskResult.objects.filter(id__in=expired_task_result_ids).exists())
+        self.assertTrue(TaskResult.objects.filter(id=self.mock_task_result.id).exists())
+
 
-class UpdateCatalogMetadataTaskTests(TestCase):
+class UpdateCatalogMetadataTaskTests(ClearTaskCachesMixin, TestCase):
     """
     Tests for the `update_catalog_metadata_task`.
     """
@@ -181,7 +316,8 @@ class UpdateCatalogMetadataTaskTests(TestCase):
         """
         Assert update_catalog_metadata_task is called with correct catalog_query_id
         """
-        tasks.update_catalog_metadata_task.apply(args=(self.catalog_query.id,))
+        with self.assertNumQueries(1):
+            tasks.update_catalog_metadata_task.apply(args=(self.catalog_query.id,))
         mock_update_data_from_discovery.assert_called_with(self.catalog_query)
 
     @mock.patch('enterprise_catalog.apps.api.tasks.update_contentmetadata_from_discovery')
@@ -190,11 +326,12 @@ class UpdateCatalogMetadataTaskTests(TestCase):
         Assert that discovery is not called if a bad catalog query id is passed
         """
         bad_id = 412
-        tasks.update_catalog_metadata_task.apply(args=(bad_id,))
+        with self.assertNumQueries(1):
+            tasks.update_catalog_metadata_task.apply(args=(bad_id,))
         mock_update_data_from_discovery.assert_not_called()
 
 
-class UpdateFullContentMetadataTaskTests(TestCase):
+class UpdateFullContentMetadataTaskTests(ClearTaskCachesMixin, TestCase):
     """
     Tests for the `update_full_content_metadata_task`.
     """
@@ -235,7 +372,9 @@ class UpdateFullContentMetadataTaskTests(TestCase):
         assert metadata_1.json_metadata != course_data_1
         assert metadata_2.json_metadata != course_data_2
 
-        tasks.update_full_content_metadata_task.apply().get()
+        # unready task check, course keys, the metadata records for the fetched courses, and a bulk update
+        with self.assertNumQueries(4):
+            tasks.update_full_content_metadata_task.apply().get()
 
         actual_course_keys_args = mock_partition_course_keys.call_args_list[0][0][0]
         self.assertEqual(set(actual_course_keys_args), set([metadata_1, metadata_2]))
@@ -254,7 +393,7 @@ class UpdateFullContentMetadataTaskTests(TestCase):
         assert metadata_2.json_metadata == course_data_2
 
 
-class IndexEnterpriseCatalogCoursesInAlgoliaTaskTests(TestCase):
+class IndexEnterpriseCatalogCoursesInAlgoliaTaskTests(ClearTaskCachesMixin, TestCase):
     """
     Tests for `index_enterprise_catalog_courses_in_algolia_task`
     """
@@ -271,26 +410,34 @@ class IndexEnterpriseCatalogCoursesInAlgoliaTaskTests(TestCase):
         cls.enterprise_catalog_courses = EnterpriseCatalogFactory()
         courses_catalog_query = cls.enterprise_catalog_courses.catalog_query
         cls.course_metadata_published = ContentMetadataFactory(content_type=COURSE, content_key='fakeX')
-        cls.course_metadata_published.catalog_queries.set([courses_catalog_query])
         cls.course_metadata_unpublished = ContentMetadataFactory(content_type=COURSE, content_key='testX')
         cls.course_metadata_unpublished.json_metadata.get('course_runs')[0].update({
             'status': 'unpublished',
         })
-        cls.course_metadata_unpublished.catalog_queries.set([courses_catalog_query])
         cls.course_metadata_unpublished.save()
 
         # Set up new catalog, query, and metadata for a course run
         cls.enterprise_catalog_course_runs = EnterpriseCatalogFactory()
         course_runs_catalog_query = cls.enterprise_catalog_course_runs.catalog_query
         course_run_metadata_published = ContentMetadataFactory(content_type=COURSE_RUN, parent_content_key='fakeX')
-        course_run_metadata_published.catalog_queries.set([course_runs_catalog_query])
         course_run_metadata_unpublished = ContentMetadataFactory(content_type=COURSE_RUN, parent_content_key='testX')
         course_run_metadata_unpublished.json_metadata.update({
             'status': 'unpublished',
         })
-        course_run_metadata_unpublished.catalog_queries.set([course_runs_catalog_query])
         course_run_metadata_unpublished.save()
 
+        # Associate the metadata with their catalog queries in a single insert
+        ContentMetadataToQueries = ContentMetadata.catalog_queries.through
+        ContentMetadataToQueries.objects.bulk_create([
+            ContentMetadataToQueries(contentmetadata=metadata, catalogquery=catalog_query)
+            for metadata, catalog_query in (
+                (cls.course_metadata_published, courses_catalog_query),
+                (cls.course_metadata_unpublished, courses_catalog_query),
+                (course_run_metadata_published, course_runs_catalog_query),
+                (course_run_metadata_unpublished, course_runs_catalog_query),
+            )
+        ])
+
     def _set_up_factory_data_for_algolia(self):
         expected_catalog_uuids = sorted([
             str(self.enterprise_catalog_courses.uuid),
@@ -313,6 +460,17 @@ class IndexEnterpriseCatalogCoursesInAlgoliaTaskTests(TestCase):
             'course_metadata_unpublished': self.course_metadata_unpublished,
         }
 
+    def _capture_indexed_algolia_objects(self, mock_search_client):
+        """
+        Consumes the Algolia objects passed to each ``replace_all_objects`` call on the mocked
+        Algolia client, as the real client would, and returns the list they are collected into.
+        """
+        indexed_algolia_objects = []
+        mock_search_client().replace_all_objects.side_effect = (
+            lambda algolia_objects: indexed_algolia_objects.append(list(algolia_objects))
+        )
+        return indexed_algolia_objects
+
     @mock.patch('enterprise_catalog.apps.api.tasks._was_recently_indexed', side_effect=[False, True])
     @mock.patch('enterprise_catalog.apps.api.tasks.get_initialized_algolia_client', return_value=mock.MagicMock())
     def test_index_algolia_with_all_uuids(self, mock_search_client, mock_was_recently_indexed):
@@ -321,11 +479,14 @@ class IndexEnterpriseCatalogCoursesInAlgoliaTaskTests(TestCase):
         catalog and enterprise customer associations.
         """
         algolia_data = self._set_up_factory_data_for_algolia()
+        actual_algolia_objects = self._capture_indexed_algolia_objects(mock_search_client)
 
         with mock.patch('enterprise_catalog.apps.api.tasks.ALGOLIA_FIELDS', self.ALGOLIA_FIELDS):
-            tasks.index_enterprise_catalog_courses_in_algolia_task()  # pylint: disable=no-value-for-parameter
+            with self.assertNumQueries(5):
+                tasks.index_enterprise_catalog_courses_in_algolia_task()  # pylint: disable=no-value-for-parameter
             # call it a second time, make assertions that only one thing happened below
-            tasks.index_enterprise_catalog_courses_in_algolia_task()  # pylint: disable=no-value-for-parameter
+            with self.assertNumQueries(5):
+                tasks.index_enterprise_catalog_courses_in_algolia_task()  # pylint: disable=no-value-for-parameter
 
         # create expected data to be added/updated in the Algolia index.
         expected_algolia_objects_to_index = []
@@ -347,11 +508,8 @@ class IndexEnterpriseCatalogCoursesInAlgoliaTaskTests(TestCase):
         })
 
         # verify replace_all_objects is called with the correct Algolia object data
-        # on the first invocation and with an empty list on the second invocation.
-        mock_search_client().replace_all_objects.assert_has_calls([
-            mock.call(expected_algolia_objects_to_index),
-            mock.call([]),
-        ])
+        # on the first invocation and with no objects on the second invocation.
+        assert actual_algolia_objects == [expected_algolia_objects_to_index, []]
 
         # Verify that we checked the cache twice, though
         mock_was_recently_indexed.assert_has_calls([
@@ -367,9 +525,11 @@ class IndexEnterpriseCatalogCoursesInAlgoliaTaskTests(TestCase):
         catalog, enterprise customer, and catalog query associations.
         """
         algolia_data = self._set_up_factory_data_for_algolia()
+        actual_algolia_objects = self._capture_indexed_algolia_objects(mock_search_client)
 
         with mock.patch('enterprise_catalog.apps.api.tasks.ALGOLIA_UUID_BATCH_SIZE', 1), \
-             mock.patch('enterprise_catalog.apps.api.tasks.ALGOLIA_FIELDS', self.ALGOLIA_FIELDS):
+             mock.patch('enterprise_catalog.apps.api.tasks.ALGOLIA_FIELDS', self.ALGOLIA_FIELDS), \
+             self.assertNumQueries(5):
             tasks.index_enterprise_catalog_courses_in_algolia_task()  # pylint: disable=no-value-for-parameter
 
         # create expected data to be added/updated in the Algolia index.
@@ -407,6 +567,6 @@ class IndexEnterpriseCatalogCoursesInAlgoliaTaskTests(TestCase):
         })
 
         # verify replace_all_objects is called with the correct Algolia object data
-        mock_search_client().replace_all_objects.assert_called_once_with(expected_algolia_objects_to_index)
+        assert actual_algolia_objects == [expected_algolia_objects_to_index]
 
         mock_was_recently_indexed.assert_called_once_with(self.course_metadata_published.content_key)
@@ -854,6 +854,13 @@ class EnterpriseCatalogRefreshDataFromDiscoveryTests(APITestMixin):
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_refresh_catalog_on_malformed_uuid_returns_404_not_found(self):
+        """
+        Verify the refresh_metadata endpoint does not resolve for a value that is not a UUID
+        """
+        response = self.client.post('/api/v1/enterprise-catalogs/not-a-uuid/refresh_metadata')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class EnterpriseCustomerViewSetTests(APITestMixin):
     """
@@ -1,7 +1,7 @@
 """
 URL definitions for enterprise catalog API version 1.
 """
-from django.conf.urls import url
+from django.urls import re_path
 from rest_framework.routers import DefaultRouter
 
 from enterprise_catalog.apps.api.v1 import views
@@ -16,13 +16,13 @@ router.register(r'enterprise-catalogs', views.EnterpriseCatalogGetContentMetadat
 router.register(r'enterprise-customer', views.EnterpriseCustomerViewSet, basename='enterprise-customer')
 
 urlpatterns = [
-    url(
-        r'^enterprise-catalogs/(?P<uuid>[\S]+)/refresh_metadata',
+    re_path(
+        r'^enterprise-catalogs/(?P<uuid>[0-9a-fA-F-]{36})/refresh_metadata/?$',
         views.EnterpriseCatalogRefreshDataFromDiscovery.as_view({'post': 'post'}),
         name='update-enterprise-catalog'
     ),
-    url(
-        r'distinct-catalog-queries',
+    re_path(
+        r'^distinct-catalog-queries/?$',
         views.DistinctCatalogQueriesView.as_view(),
         name='distinct-catalog-queries',
     ),
@@ -121,7 +121,7 @@ class EnterpriseCatalogCRUDViewSet(BaseViewSet, viewsets.ModelViewSet):
         return all_catalogs
 
 
-class EnterpriseCatalogContainsContentItems(BaseViewSet, viewsets.ModelViewSet):
+class EnterpriseCatalogContainsContentItems(BaseViewSet, GenericAPIView):
     """
     View to determine if an enterprise catalog contains certain content
     """
@@ -99,25 +99,34 @@ class AlgoliaSearchClient:
         See https://www.algolia.com/doc/api-reference/api-methods/replace-all-objects/ for more detials.
 
         Arguments:
-            algolia_objects (list): List of objects to include in the Algolia index
+            algolia_objects (iterable): Objects to include in the Algolia index. This may be a generator, in
+                which case the objects are sent to Algolia in chunks as they are generated.
         """
         if not self.index_exists():
             # index must exist to continue, nothing left to do
             return
 
+        object_count = 0
+
+        def count_objects(objects):
+            nonlocal object_count
+            for algolia_object in objects:
+                object_count += 1
+                yield algolia_object
+
         try:
-            self.algolia_index.replace_all_objects(algolia_objects, {
+            self.algolia_index.replace_all_objects(count_objects(algolia_objects), {
                 'safe': True,  # wait for asynchronous indexing operations to complete
             })
             logger.info(
                 'The %s Algolia index was successfully indexed with %s objects.',
                 self.ALGOLIA_INDEX_NAME,
-                len(algolia_objects),
+                object_count,
             )
         except AlgoliaException as exc:
             logger.exception(
-                'Could not index %s objects in the %s Algolia index due to an exception.',
-                len(algolia_objects),
+                'Could not index objects in the %s Algolia index due to an exception after %s objects.',
                 self.ALGOLIA_INDEX_NAME,
+                object_count,
             )
             raise exc
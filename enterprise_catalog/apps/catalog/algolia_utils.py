@@ -1,4 +1,4 @@
-import copy
+import functools
 import logging
 
 from enterprise_catalog.apps.api.v1.utils import is_course_run_active
@@ -9,9 +9,16 @@ logger = logging.getLogger(__name__)
 
 ALGOLIA_UUID_BATCH_SIZE = 100
 
+# facet values for the "Availability" facet, keyed by the lowercased course run availability
+DEFAULT_COURSE_AVAILABILITY = 'Archived'
+COURSE_AVAILABILITY_MESSAGES = {
+    'current': 'Available Now',
+    'upcoming': 'Upcoming',
+}
+
 
 # keep attributes from course objects that we explicitly want in Algolia
-ALGOLIA_FIELDS = [
+ALGOLIA_FIELDS = (
     'additional_information',
     'availability',
     'card_image_url',  # for display on course cards
@@ -33,7 +40,7 @@ ALGOLIA_FIELDS = [
     'skills',
     'title',
     'advertised_course_run',  # a part of the advertised course run
-]
+)
 
 # default configuration for the index
 ALGOLIA_INDEX_SETTINGS = {
@@ -75,6 +82,19 @@ ALGOLIA_INDEX_SETTINGS = {
 
 
 def _should_index_course(course_metadata):
+    """
+    Returns whether the course represented by a ContentMetadata record should be indexed for search.
+
+    Args:
+        course_metadata (ContentMetadata): The ContentMetadata representing a course object.
+
+    Returns:
+        bool: Whether or not the course should be indexed by algolia.
+    """
+    return _should_index_course_json(course_metadata.json_metadata)
+
+
+def _should_index_course_json(course_json_metadata):
     """
     Replicates the B2C index check of whether a certain course should be indexed for search.
 
@@ -88,26 +108,45 @@ def _should_index_course(course_metadata):
     https://github.com/edx/course-discovery/blob/c6ac5329225e2f32cdf1d1da855d7c9d905b2576/course_discovery/apps/course_metadata/algolia_models.py#L218-L227
 
     Args:
-        course (ContentMetadata): The ContentMetadata representing a course object.
+        course_json_metadata (dict): The json_metadata of the ContentMetadata representing a course object.
 
     Returns:
         bool: Whether or not the course should be indexed by algolia.
     """
-    course_json_metadata = course_metadata.json_metadata
-    advertised_course_run_uuid = course_json_metadata.get('advertised_course_run_uuid')
-    advertised_course_run = _get_course_run_by_uuid(
-        course_json_metadata,
-        advertised_course_run_uuid,
-    )
+    advertised_course_run = _resolve_advertised_course_run(course_json_metadata)
 
-    if advertised_course_run is None:
+    if advertised_course_run is None or advertised_course_run.get('hidden'):
         return False
 
-    if not is_course_run_active(advertised_course_run):
+    if not course_json_metadata.get('owners'):
         return False
 
-    owners = course_json_metadata.get('owners') or []
-    return not advertised_course_run.get('hidden') and len(owners) > 0
+    return bool(is_course_run_active(advertised_course_run))
+
+
+def _partition_course_keys(content_keys_and_json_metadata):
+    """
+    Splits course content keys into those that should and should not be indexed for Algolia.
+
+    Args:
+        content_keys_and_json_metadata (iterable of tuple): ``(content_key, json_metadata)`` pairs of the
+            ContentMetadata records representing courses that should be filtered down.
+
+    Returns:
+        indexable_course_keys (list): Content key strings to be indexed
+        nonindexable_course_keys (list): Content key strings to NOT be indexed
+    """
+    indexable_course_keys = []
+    nonindexable_course_keys = []
+
+    # content_key is unique per ContentMetadata, so the keys need no de-duplication
+    for content_key, json_metadata in content_keys_and_json_metadata:
+        if _should_index_course_json(json_metadata):
+            indexable_course_keys.append(content_key)
+        else:
+            nonindexable_course_keys.append(content_key)
+
+    return indexable_course_keys, nonindexable_course_keys
 
 
 def partition_course_keys_for_indexing(courses_content_metadata):
@@ -122,16 +161,29 @@ def partition_course_keys_for_indexing(courses_content_metadata):
         indexable_course_keys (list): Content key strings to be indexed
         nonindexable_course_keys (list): Content key strings to NOT be indexed
     """
-    indexable_course_keys = set()
-    nonindexable_course_keys = set()
+    return _partition_course_keys(
+        (course_metadata.content_key, course_metadata.json_metadata)
+        for course_metadata in courses_content_metadata
+    )
 
-    for course_metadata in courses_content_metadata:
-        if _should_index_course(course_metadata):
-            indexable_course_keys.add(course_metadata.content_key)
-        else:
-            nonindexable_course_keys.add(course_metadata.content_key)
 
-    return list(indexable_course_keys), list(nonindexable_course_keys)
+def partition_course_keys_for_indexing_values(courses_content_metadata_values):
+    """
+    Returns both the indexable and non-indexable course content keys for Algolia, given only the fields of the
+    ContentMetadata records that are needed to decide, e.g. from ``.values('content_key', 'json_metadata')``.
+
+    Args:
+        courses_content_metadata_values (iterable of dict): ``content_key`` and ``json_metadata`` values of the
+            ContentMetadata records representing courses that should be filtered down.
+
+    Returns:
+        indexable_course_keys (list): Content key strings to be indexed
+        nonindexable_course_keys (list): Content key strings to NOT be indexed
+    """
+    return _partition_course_keys(
+        (course_metadata_values['content_key'], course_metadata_values['json_metadata'])
+        for course_metadata_values in courses_content_metadata_values
+    )
 
 
 def get_initialized_algolia_client():
@@ -165,18 +217,20 @@ def get_algolia_object_id(uuid):
     return None
 
 
-def get_course_language(course):
+def get_course_language(course, advertised_course_run=None):
     """
     Gets the human-readable language name associated with the advertised course run. Used for
     the "Language" facet in Algolia.
 
     Arguments:
         course (dict): a dict representing with course metadata
+        advertised_course_run (dict): the course's full advertised course run, if already looked up
 
     Returns:
         string: human-readable language name parsed from a language code, or None if language name is not present.
     """
-    advertised_course_run = _get_course_run_by_uuid(course, course.get('advertised_course_run_uuid'))
+    if advertised_course_run is None:
+        advertised_course_run = _resolve_advertised_course_run(course)
     if not advertised_course_run:
         return None
 
@@ -194,19 +248,21 @@ def get_course_availability(course):
     Returns:
         list: a list of availabilities for those course runs (e.g., "Upcoming")
     """
-    DEFAULT_COURSE_AVAILABILITY = 'Archived'
-    COURSE_AVAILABILITY_MESSAGES = {
-        'current': 'Available Now',
-        'upcoming': 'Upcoming',
-    }
-    course_runs = course.get('course_runs') or []
-    active_course_runs = [run for run in course_runs if is_course_run_active(run)]
-    availability = set()
-    for course_run in active_course_runs:
+    course_runs = course.get('course_runs')
+    if not course_runs:
+        return []
+
+    # bound locally as it is called for every course run
+    is_active = is_course_run_active
+    # a dict rather than a set so the availabilities keep the order of the course runs
+    availability = {}
+    for course_run in course_runs:
+        if not is_active(course_run):
+            continue
         run_availability = course_run.get('availability') or ''
-        availability.add(
+        availability[
             COURSE_AVAILABILITY_MESSAGES.get(run_availability.lower(), DEFAULT_COURSE_AVAILABILITY)
-        )
+        ] = None
     return list(availability)
 
 
@@ -221,36 +277,42 @@ def get_course_partners(course):
     Returns:
         list: a list of partner metadata associated with the course
     """
-    partners = []
-    owners = course.get('owners') or []
-
-    for owner in owners:
-        partner_name = owner.get('name')
-        if partner_name:
-            partner_metadata = {
-                'name': partner_name,
-                'logo_image_url': owner.get('logo_image_url'),
-            }
-            partners.append(partner_metadata)
-
-    return partners
+    owners = course.get('owners')
+    if not owners:
+        return []
+
+    return [
+        {
+            'name': partner_name,
+            'logo_image_url': owner.get('logo_image_url'),
+        }
+        for owner in owners
+        if (partner_name := owner.get('name'))
+    ]
 
 
-def _get_course_program_field(course, field):
+def _get_course_program_fields(course, fields):
     """
-    Helper to pluck a list of values for the given field out of a course's programs.
+    Helper to pluck lists of values for the given fields out of a course's programs in a single pass.
 
     Arguments:
         course (dict): a dictionary representing a course
-        field (str): the name of a field to return values of.
+        fields (iterable): the names of the fields to return values of.
     Returns:
-        list: a list of the values for a certain field in a program associated with the course.
+        dict: maps each field to a list of the unique values for it in the programs associated with the course,
+            in the order the programs are listed.
     """
-    programs = course.get('programs') or []
-    return list({
-        value for program in programs
-        if (value := program.get(field))
-    })
+    programs = course.get('programs')
+    if not programs:
+        return {field: [] for field in fields}
+
+    field_values = {field: {} for field in fields}
+    for program in programs:
+        for field, values in field_values.items():
+            value = program.get(field)
+            if value:
+                values[value] = None
+    return {field: list(values) for field, values in field_values.items()}
 
 
 def get_course_program_types(course):
@@ -264,7 +326,7 @@ def get_course_program_types(course):
     Returns:
         list: a list of program types associated with the course
     """
-    return _get_course_program_field(course, 'type')
+    return _get_course_program_fields(course, ['type'])['type']
 
 
 def get_course_program_titles(course):
@@ -278,7 +340,7 @@ def get_course_program_titles(course):
     Returns:
         list: a list of program titles associated with the course.
     """
-    return _get_course_program_field(course, 'title')
+    return _get_course_program_fields(course, ['title'])['title']
 
 
 def get_course_subjects(course):
@@ -296,17 +358,20 @@ def get_course_subjects(course):
     Returns:
         list: a list of subject names associated with the course
     """
-    subject_names = set()
-    subjects = course.get('subjects') or []
+    subjects = course.get('subjects')
+    if not subjects:
+        return []
 
+    # a dict rather than a set so the names keep the order they are listed in
+    subject_names = {}
     for subject in subjects:
         if isinstance(subject, str):
-            subject_names.add(subject)
+            subject_names[subject] = None
             continue
 
         subject_name = subject.get('name')
         if subject_name:
-            subject_names.add(subject_name)
+            subject_names[subject_name] = None
 
     return list(subject_names)
 
@@ -335,8 +400,10 @@ def get_course_skill_names(course):
     Returns:
         list: a list of skill names associated with the course
     """
-    skill_names = course.get('skill_names') or []
-    return list(set(skill_names))
+    skill_names = course.get('skill_names')
+    if not skill_names:
+        return []
+    return list(dict.fromkeys(skill_names))
 
 
 def get_course_skills(course):
@@ -349,21 +416,26 @@ def get_course_skills(course):
     Returns:
         skills (list): list of dictionaries containing skill name, description
     """
-    skills = course.get('skills') or []
+    skills = course.get('skills')
+    if not skills:
+        return []
     return list(skills)
 
 
-def get_advertised_course_run(course):
+def get_advertised_course_run(course, advertised_course_run=None):
     """
     Get part of the advertised course_run as per advertised_course_run_uuid
 
     Argument:
         course (dict)
+        advertised_course_run (dict): the course's full advertised course run, if already looked up
 
     Returns:
         dict: containing key, pacing_type, start and end for the course_run, or None
     """
-    full_course_run = _get_course_run_by_uuid(course, course.get('advertised_course_run_uuid'))
+    full_course_run = advertised_course_run
+    if full_course_run is None:
+        full_course_run = _resolve_advertised_course_run(course)
     if full_course_run is None:
         return None
     course_run = {
@@ -386,11 +458,122 @@ def _get_course_run_by_uuid(course, course_run_uuid):
     Returns:
         dict: a course_run or None
     """
-    try:
-        course_run = [run for run in course.get('course_runs', []) if run.get('uuid') == course_run_uuid][0]
-    except IndexError:
-        return None
-    return course_run
+    course_runs = course.get('course_runs') or []
+    return next((run for run in course_runs if run.get('uuid') == course_run_uuid), None)
+
+
+def _resolve_advertised_course_run(course):
+    """
+    Find a course's advertised course_run
+
+    Arguments:
+        course (dict): course dict
+
+    Returns:
+        dict: the course_run matching the course's advertised_course_run_uuid, or None
+    """
+    return _get_course_run_by_uuid(course, course.get('advertised_course_run_uuid'))
+
+
+# Algolia-only fields derived from the course metadata, mapped to the function that computes each one.
+#
+# Builders must only read from the course. Algolia objects are built straight from the course dict rather than from
+# a deep copy of it, so a builder that mutated its input would change what later fields and the caller see.
+ALGOLIA_FIELD_BUILDERS = {
+    'availability': get_course_availability,
+    'partners': get_course_partners,
+    'subjects': get_course_subjects,
+    'card_image_url': get_course_card_image_url,
+    'skill_names': get_course_skill_names,
+    'skills': get_course_skills,
+}
+
+# Derived fields whose builder also takes the course's advertised course run, so it is only looked up once per course.
+ALGOLIA_ADVERTISED_RUN_FIELD_BUILDERS = {
+    'language': get_course_language,
+    'advertised_course_run': get_advertised_course_run,
+}
+
+# Derived fields plucked from the course's programs, mapped to the program field they are built from.
+ALGOLIA_PROGRAM_FIELDS = {
+    'programs': 'type',
+    'program_titles': 'title',
+}
+
+# All derived fields, so plain fields can be told apart with a single lookup.
+ALGOLIA_DERIVED_FIELDS = frozenset().union(
+    ALGOLIA_FIELD_BUILDERS,
+    ALGOLIA_ADVERTISED_RUN_FIELD_BUILDERS,
+    ALGOLIA_PROGRAM_FIELDS,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _build_algolia_transform(algolia_fields):
+    """
+    Builds (and caches) the function that transforms a course into an Algolia object for a tuple of fields.
+    """
+    plain_fields = tuple(field for field in algolia_fields if field not in ALGOLIA_DERIVED_FIELDS)
+    advertised_run_field_builders = tuple(
+        (field, ALGOLIA_ADVERTISED_RUN_FIELD_BUILDERS[field])
+        for field in algolia_fields if field in ALGOLIA_ADVERTISED_RUN_FIELD_BUILDERS
+    )
+    program_fields = tuple(
+        (field, ALGOLIA_PROGRAM_FIELDS[field])
+        for field in algolia_fields if field in ALGOLIA_PROGRAM_FIELDS
+    )
+    program_field_names = tuple(program_field_name for __, program_field_name in program_fields)
+    field_builders = tuple(
+        (field, ALGOLIA_FIELD_BUILDERS[field])
+        for field in algolia_fields if field in ALGOLIA_FIELD_BUILDERS
+    )
+
+    def algolia_transform(course):
+        algolia_object = {}
+        for field in plain_fields:
+            field_value = course.get(field)
+            if field_value is not None:
+                algolia_object[field] = field_value
+
+        if advertised_run_field_builders:
+            advertised_course_run = _resolve_advertised_course_run(course)
+            for field, field_builder in advertised_run_field_builders:
+                field_value = field_builder(course, advertised_course_run=advertised_course_run)
+                if field_value is not None:
+                    algolia_object[field] = field_value
+
+        if program_fields:
+            program_field_values = _get_course_program_fields(course, program_field_names)
+            for field, program_field_name in program_fields:
+                algolia_object[field] = program_field_values[program_field_name]
+
+        for field, field_builder in field_builders:
+            field_value = field_builder(course)
+            if field_value is not None:
+                algolia_object[field] = field_value
+
+        return algolia_object
+
+    return algolia_transform
+
+
+def build_algolia_transform(algolia_fields):
+    """
+    Returns a function that transforms a course into an Algolia object with the given fields.
+
+    Which fields are read from the course as-is and which are derived (by the builders in ``ALGOLIA_FIELD_BUILDERS``
+    and ``ALGOLIA_ADVERTISED_RUN_FIELD_BUILDERS``, or from the programs per ``ALGOLIA_PROGRAM_FIELDS``) is worked
+    out once per distinct list of fields, rather than once per field of every course. None of the builders mutate
+    the course, so it is not copied.
+
+    Arguments:
+        algolia_fields (list): list of fields to extract from courses
+
+    Returns:
+        callable: takes a course dict and returns a dictionary containing only the fields noted in algolia_fields
+            that have a value
+    """
+    return _build_algolia_transform(tuple(algolia_fields or ()))
 
 
 def _algolia_object_from_course(course, algolia_fields):
@@ -404,27 +587,23 @@ def _algolia_object_from_course(course, algolia_fields):
     Returns:
         dict: a dictionary containing only the fields noted in algolia_fields
     """
-    searchable_course = copy.deepcopy(course)
-    searchable_course.update({
-        'language': get_course_language(searchable_course),
-        'availability': get_course_availability(searchable_course),
-        'partners': get_course_partners(searchable_course),
-        'programs': get_course_program_types(searchable_course),
-        'program_titles': get_course_program_titles(searchable_course),
-        'subjects': get_course_subjects(searchable_course),
-        'card_image_url': get_course_card_image_url(searchable_course),
-        'advertised_course_run': get_advertised_course_run(searchable_course),
-        'skill_names': get_course_skill_names(searchable_course),
-        'skills': get_course_skills(searchable_course),
-    })
-
-    algolia_object = {}
-    for field in algolia_fields:
-        field_value = searchable_course.get(field)
-        if field_value is not None:
-            algolia_object[field] = field_value
-
-    return algolia_object
+    return build_algolia_transform(algolia_fields)(course)
+
+
+def iter_algolia_objects_from_courses(courses, algolia_fields):
+    """
+    Lazily transforms courses into Algolia objects, one course at a time.
+
+    Arguments:
+        courses (iterable): iterable of courses
+        algolia_fields (list): list of fields to extract from courses
+
+    Yields:
+        dict: an Algolia object containing only the fields noted in algolia_fields
+    """
+    algolia_transform = build_algolia_transform(algolia_fields)
+    for course in courses:
+        yield algolia_transform(course)
 
 
 def create_algolia_objects_from_courses(courses, algolia_fields):
@@ -438,12 +617,4 @@ def create_algolia_objects_from_courses(courses, algolia_fields):
     Returns:
         list: a list of Algolia objects containing only the fields noted in algolia_fields
     """
-    if not algolia_fields:
-        algolia_fields = []
-
-    algolia_objects = [
-        _algolia_object_from_course(course, algolia_fields)
-        for course in courses
-    ]
-
-    return algolia_objects
+    return list(iter_algolia_objects_from_courses(courses, algolia_fields))
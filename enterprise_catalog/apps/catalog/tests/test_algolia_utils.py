@@ -1,3 +1,5 @@
+import copy
+import types
 from unittest import mock
 from uuid import uuid4
 
@@ -6,8 +8,13 @@ from django.test import TestCase
 
 from enterprise_catalog.apps.catalog.algolia_utils import (
     ALGOLIA_INDEX_SETTINGS,
+    _algolia_object_from_course,
+    _get_course_program_fields,
+    _get_course_run_by_uuid,
     _should_index_course,
+    build_algolia_transform,
     configure_algolia_index,
+    create_algolia_objects_from_courses,
     get_advertised_course_run,
     get_course_availability,
     get_course_card_image_url,
@@ -18,8 +25,12 @@ from enterprise_catalog.apps.catalog.algolia_utils import (
     get_course_skill_names,
     get_course_subjects,
     get_initialized_algolia_client,
+    iter_algolia_objects_from_courses,
+    partition_course_keys_for_indexing,
+    partition_course_keys_for_indexing_values,
 )
 from enterprise_catalog.apps.catalog.constants import COURSE
+from enterprise_catalog.apps.catalog.models import ContentMetadata
 from enterprise_catalog.apps.catalog.tests.factories import (
     ContentMetadataFactory,
 )
@@ -35,6 +46,7 @@ class AlgoliaUtilsTests(TestCase):
     """
 
     @ddt.data(
+        {'expected_result': True},
         {'expected_result': False, 'has_advertised_course_run': False},
         {'expected_result': False, 'has_owners': False},
         {'expected_result': False, 'advertised_course_run_hidden': True},
@@ -79,6 +91,43 @@ class AlgoliaUtilsTests(TestCase):
         )
         assert _should_index_course(course_metadata) is expected_result
 
+    def test_partition_course_keys_for_indexing(self):
+        """
+        Assert course keys are split into indexable and non-indexable lists, in the order they were given, whether
+        partitioning ContentMetadata records or just their values.
+        """
+        def make_course(indexable):
+            advertised_course_run_uuid = uuid4()
+            return ContentMetadataFactory.create(
+                content_type=COURSE,
+                json_metadata={
+                    'advertised_course_run_uuid': advertised_course_run_uuid,
+                    'course_runs': [{
+                        'uuid': advertised_course_run_uuid,
+                        'hidden': not indexable,
+                        'status': 'published',
+                        'is_enrollable': True,
+                        'is_marketable': True,
+                    }],
+                    'owners': [{'name': 'edX'}],
+                },
+            )
+
+        courses = [make_course(indexable) for indexable in (True, False, True, False)]
+
+        indexable_course_keys, nonindexable_course_keys = partition_course_keys_for_indexing(courses)
+
+        assert indexable_course_keys == [courses[0].content_key, courses[2].content_key]
+        assert nonindexable_course_keys == [courses[1].content_key, courses[3].content_key]
+
+        courses_values = ContentMetadata.objects.filter(
+            pk__in=[course.pk for course in courses],
+        ).order_by('pk').values('content_key', 'json_metadata')
+        assert partition_course_keys_for_indexing_values(courses_values) == (
+            indexable_course_keys,
+            nonindexable_course_keys,
+        )
+
     @ddt.data(
         (
             {
@@ -201,6 +250,10 @@ class AlgoliaUtilsTests(TestCase):
             },
             ['Computer Science', 'Communication'],
         ),
+        (
+            {'subjects': ['Communication', {'name': 'Communication'}, {'name': ''}, 'Computer Science']},
+            ['Communication', 'Computer Science'],
+        ),
         (
             {'subjects': None},
             [],
@@ -217,7 +270,7 @@ class AlgoliaUtilsTests(TestCase):
         and a list of dictionaries.
         """
         course_subjects = get_course_subjects(course_metadata)
-        assert sorted(course_subjects) == sorted(expected_subjects)
+        assert course_subjects == expected_subjects
 
     @ddt.data(
         (
@@ -247,6 +300,13 @@ class AlgoliaUtilsTests(TestCase):
             },
             None,
         ),
+        (
+            {
+                'course_runs': None,
+                'advertised_course_run_uuid': ADVERTISED_COURSE_RUN_UUID
+            },
+            None,
+        ),
     )
     @ddt.unpack
     def test_get_advertised_course_run(self, searchable_course, expected_course_run):
@@ -290,6 +350,37 @@ class AlgoliaUtilsTests(TestCase):
             },
             ['Archived'],
         ),
+        (
+            {
+                'course_runs': [
+                    {
+                        'status': 'published',
+                        'is_enrollable': True,
+                        'is_marketable': True,
+                        'availability': 'Upcoming'
+                    },
+                    {
+                        'status': 'unpublished',
+                        'is_enrollable': True,
+                        'is_marketable': True,
+                        'availability': 'Archived'
+                    },
+                    {
+                        'status': 'published',
+                        'is_enrollable': True,
+                        'is_marketable': True,
+                        'availability': 'Current'
+                    },
+                    {
+                        'status': 'published',
+                        'is_enrollable': True,
+                        'is_marketable': True,
+                        'availability': 'Upcoming'
+                    },
+                ]
+            },
+            ['Upcoming', 'Available Now'],
+        ),
     )
     @ddt.unpack
     def test_get_course_availability(self, course_metadata, expected_availability):
@@ -343,11 +434,35 @@ class AlgoliaUtilsTests(TestCase):
         program_titles = get_course_program_titles(course_metadata)
         assert program_titles == expected_program_titles
 
+    def test_get_course_program_fields(self):
+        """
+        Assert that values for several program fields are plucked out together, in order and without empty values
+        or duplicates.
+        """
+        course = {
+            'programs': [
+                {'type': 'MicroMasters', 'title': 'Data Science'},
+                {'type': 'MicroMasters', 'title': 'Supply Chain'},
+                {'type': '', 'title': 'Orphaned'},
+            ],
+        }
+        program_fields = _get_course_program_fields(course, ['type', 'title'])
+        assert program_fields['type'] == ['MicroMasters']
+        assert program_fields['title'] == ['Data Science', 'Supply Chain', 'Orphaned']
+
     @ddt.data(
         (
             {'skill_names': ['Python', 'Programming']},
             ['Python', 'Programming'],
         ),
+        (
+            {'skill_names': ['Python', 'Programming', 'Python']},
+            ['Python', 'Programming'],
+        ),
+        (
+            {'skill_names': None},
+            [],
+        ),
     )
     @ddt.unpack
     def test_get_course_skill_names(self, course_metadata, expected_skill_names):
@@ -355,7 +470,109 @@ class AlgoliaUtilsTests(TestCase):
         Assert the list of skill names associated with a course is properly parsed.
         """
         skill_names = get_course_skill_names(course_metadata)
-        assert sorted(skill_names) == sorted(expected_skill_names)
+        assert skill_names == expected_skill_names
+
+    def test_algolia_object_from_course(self):
+        """
+        Assert that derived fields are computed, plain fields are read from the course, fields without a value are
+        omitted, and the course itself is left untouched.
+        """
+        course = {
+            'key': 'edX+DemoX',
+            'title': 'Demo Course',
+            'image_url': 'https://example.com/image.jpg',
+            'advertised_course_run_uuid': ADVERTISED_COURSE_RUN_UUID,
+            'course_runs': [{
+                'key': 'course-v1:edX+DemoX+1T2021',
+                'uuid': ADVERTISED_COURSE_RUN_UUID,
+                'content_language_search_facet_name': 'English',
+                'pacing_type': 'self_paced',
+                'start': '2021-01-01T00:00:00Z',
+                'end': '2022-01-01T00:00:00Z',
+            }],
+            'programs': [{'type': 'MicroMasters', 'title': 'Demo Program'}],
+            'short_description': None,
+        }
+        original_course = copy.deepcopy(course)
+        algolia_fields = [
+            'key',
+            'title',
+            'card_image_url',
+            'language',
+            'programs',
+            'program_titles',
+            'advertised_course_run',
+            'short_description',
+            'full_description',
+        ]
+
+        algolia_object = _algolia_object_from_course(course, algolia_fields)
+
+        assert algolia_object == {
+            'key': 'edX+DemoX',
+            'title': 'Demo Course',
+            'card_image_url': 'https://example.com/image.jpg',
+            'language': 'English',
+            'programs': ['MicroMasters'],
+            'program_titles': ['Demo Program'],
+            'advertised_course_run': {
+                'key': 'course-v1:edX+DemoX+1T2021',
+                'pacing_type': 'self_paced',
+                'start': '2021-01-01T00:00:00Z',
+                'end': '2022-01-01T00:00:00Z',
+            },
+        }
+        assert course == original_course
+
+    def test_algolia_object_from_course_looks_up_advertised_course_run_once(self):
+        """
+        Assert the advertised course run is looked up once per course and shared by the fields derived from it.
+        """
+        course = {
+            'advertised_course_run_uuid': ADVERTISED_COURSE_RUN_UUID,
+            'course_runs': [
+                {'uuid': uuid4()},
+                {'uuid': ADVERTISED_COURSE_RUN_UUID, 'key': 'course-v1:edX+DemoX+1T2021'},
+            ],
+        }
+        with mock.patch(
+            'enterprise_catalog.apps.catalog.algolia_utils._get_course_run_by_uuid',
+            wraps=_get_course_run_by_uuid,
+        ) as mock_get_course_run_by_uuid:
+            algolia_object = _algolia_object_from_course(course, ['language', 'advertised_course_run'])
+
+        mock_get_course_run_by_uuid.assert_called_once_with(course, ADVERTISED_COURSE_RUN_UUID)
+        assert algolia_object['advertised_course_run']['key'] == 'course-v1:edX+DemoX+1T2021'
+
+    def test_build_algolia_transform(self):
+        """
+        Assert the transform for a list of fields is built once and reused, and only computes the fields requested.
+        """
+        algolia_transform = build_algolia_transform(['key', 'availability'])
+        assert build_algolia_transform(('key', 'availability')) is algolia_transform
+
+        course = {'key': 'edX+DemoX', 'title': 'Demo', 'course_runs': []}
+        with mock.patch(
+            'enterprise_catalog.apps.catalog.algolia_utils._get_course_program_fields',
+        ) as mock_get_course_program_fields:
+            assert algolia_transform(course) == {'key': 'edX+DemoX', 'availability': []}
+        mock_get_course_program_fields.assert_not_called()
+
+    def test_iter_algolia_objects_from_courses(self):
+        """
+        Assert courses are transformed lazily, and that the list-returning wrapper produces the same objects.
+        """
+        courses = [{'key': 'edX+DemoX', 'title': 'Demo'}, {'key': 'edX+TestX'}]
+
+        algolia_objects = iter_algolia_objects_from_courses(iter(courses), ['key', 'title'])
+
+        assert isinstance(algolia_objects, types.GeneratorType)
+        assert next(algolia_objects) == {'key': 'edX+DemoX', 'title': 'Demo'}
+        assert list(algolia_objects) == [{'key': 'edX+TestX'}]
+        assert create_algolia_objects_from_courses(courses, ['key', 'title']) == [
+            {'key': 'edX+DemoX', 'title': 'Demo'},
+            {'key': 'edX+TestX'},
+        ]
 
     @mock.patch('enterprise_catalog.apps.catalog.algolia_utils.AlgoliaSearchClient')
     def test_get_initialized_algolia_client(self, mock_search_client):
@@ -313,6 +313,9 @@ CELERY_BROKER_URL = '{}://{}:{}@{}/{}'.format(
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_TASK_IGNORE_RESULT = False
 CELERY_TASK_STORE_ERRORS_EVEN_IF_IGNORED = True
+# Task results are only consulted for recently run tasks, so keep the results table small.
+# Celery beat schedules its built-in `celery.backend_cleanup` task once this is set.
+CELERY_RESULT_EXPIRES = 60 * 60 * 8
 
 # Celery task time limits.
 # Tasks will be asked to quit after 15 minutes...
@@ -331,6 +334,14 @@ CELERY_BROKER_TRANSPORT_OPTIONS = {
 # Only allow each worker to run 100 tasks before restarting
 CELERY_WORKER_MAX_TASKS_PER_CHILD = 100
 
+# Periodic tasks run by celery beat
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-task-results': {
+        'task': 'enterprise_catalog.apps.api.tasks.purge_expired_task_results',
+        'schedule': 60 * 60 * 24,
+    },
+}
+
 """############################# END CELERY ##################################"""
 
 MEDIA_STORAGE_BACKEND = {
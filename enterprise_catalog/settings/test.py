@@ -22,6 +22,8 @@ DATABASES = {
 
 # CELERY
 CELERY_TASK_ALWAYS_EAGER = True
+# Tasks run in-process, so make sure nothing ever tries to reach a real broker
+CELERY_BROKER_URL = 'memory://'
 # END CELERY
 
 results_dir = tempfile.TemporaryDirectory()